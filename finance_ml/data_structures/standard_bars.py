@@ -1,9 +1,29 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
-from collections import OrderedDict
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional, fall back to plain python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+    NUMBA_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
 
 # constants
 POSSIBLE_BAR_TYPES = ['tick', 'volume', 'dollar']
+BAR_TYPE_COLS = {'tick': 'ticks', 'volume': 'volume', 'dollar': 'dollar'}
+BAR_COLUMNS = ['date_time', 'open', 'high', 'low', 'close', 'ticks', 'volume', 'dollar']
+# aggregation of each bars column, from the datetime, price, volume and dollar values
+BAR_AGG_OPS = ['last', 'first', 'max', 'min', 'last', 'count', 'sum', 'sum']
+# NaN skipping reductions, as pandas groupby aggregations
+REDUCE_UFUNCS = {'max': np.fmax, 'min': np.fmin}
 
 
 def sample_bar(df, bar_type, threshold='auto', datetime_col='date_time', 
@@ -25,192 +45,537 @@ def sample_bar(df, bar_type, threshold='auto', datetime_col='date_time',
         dateframe: dataframe with chosen bar type
     """
 
-    # check if cols exist in df
-    assert datetime_col in df.columns, 'Missing {} columns in dataframe'.format(
-        datetime_col)
-    assert price_col in df.columns, 'Missing {} columns in dataframe'.format(
-        price_col)
-    assert vol_col in df.columns, 'Missing {} columns in dataframe'.format(
-        vol_col)
-    
     # check bar type
     assert bar_type in POSSIBLE_BAR_TYPES, 'Expected bar_type to be one of {}, but got {} instead'.format(
         POSSIBLE_BAR_TYPES, bar_type)
     
-    # make a copy
-    aux = df.copy(deep=True)
-    aux['ticks'] = 1
-    aux['dollar'] = aux[price_col] * aux[vol_col]
-    if bar_type == 'tick':
-        bars = _get_tick_bar(aux, threshold=threshold, rounding=rounding, auto_ratio=auto_ratio)
-    elif bar_type == 'volume':
-        bars = _get_volume_bar(aux, threshold=threshold, rounding=rounding, auto_ratio=auto_ratio)
-    else:
-        bars = _get_dollar_bar(aux, threshold=threshold, rounding=rounding, auto_ratio=auto_ratio)
+    date_time, price, volume = _get_arrays(df, datetime_col, price_col, vol_col)
+    bars = _get_bar(date_time, price, volume, tgt_col=BAR_TYPE_COLS[bar_type],
+                    threshold=threshold, rounding=rounding, auto_ratio=auto_ratio)
     
     return bars
 
 
-def _get_tick_bar(df, threshold=1000, rounding=-2, auto_ratio=1/50):
-    """Tick bar sampling.
+def sample_bars_all(df, thresholds=None, datetime_col='date_time', price_col='price',
+                    vol_col='volume', rounding=-2, auto_ratio=1/50):
+    """Sample tick, volume and dollar bars at once, sharing a single pass over
+    the tick data and sampling the three bar types in parallel threads.
     
     Args:
-        df (dataframe): tick data dataframe
-        threshold (int, optional): threshold for sampling. Defaults to 1000.
+        df (dataframe): tick data dataframe with at least datetime, price and volume columns for the asset
+        thresholds (dict, optional): threshold for each bar type, as in `sample_bar`. Missing bar
+        types are set to 'auto'. Defaults to None (all 'auto').
+        datetime_col (str, optional): column name where datetime values. Defaults to 'date_time'.
+        price_col (str, optional): column name where price values. Defaults to 'price'.
+        vol_col (str, optional): column name where volume values. Defaults to 'volume'.
         rounding (int, optional): decimal rounding for threshold. Defaults to -2.
         auto_ratio (float, optional): ratio for automatic threshold setting. Defaults to 1/50.
     
     Returns:
-        dataframe: dataframe with tick bars
-    """
-    # assing col with number of ticks
-    df['cum_ticks'] = df['ticks'].cumsum()
-    
-    # get groups
-    groups = _assign_groups_threshold(
-        df, threshold=threshold, tgt_col='ticks', cum_col='cum_ticks',
-        rounding=rounding, auto_ratio=auto_ratio)
-    
-    # group by groups (of threshold ticks)
-    bars = df.groupby(groups, as_index=False).agg(OrderedDict([
-        ('date_time', 'last'),
-        ('price', ['first', np.max, np.min, 'last']),
-        ('ticks', np.sum),
-        ('volume', np.sum),
-        ('dollar', np.sum),
-    ]))
-    # rename cols
-    bars.columns = bars.columns.droplevel(0)
-    bars.columns = ['date_time', 'open', 'high', 'low', 'close', 
-                    'ticks', 'volume', 'dollar']
-    return bars
+        dict: dataframe with bars for each bar type
+    """
+    thresholds = {} if thresholds is None else thresholds
+    
+    # check bar types
+    unknown = set(thresholds) - set(POSSIBLE_BAR_TYPES)
+    assert not unknown, 'Expected thresholds keys to be in {}, but got {} instead'.format(
+        POSSIBLE_BAR_TYPES, sorted(unknown))
+    
+    date_time, price, volume = _get_arrays(df, datetime_col, price_col, vol_col)
+    dollar = np.multiply(price, volume, dtype=np.float64)
+    
+    # cumulative values and threshold for each bar type, in POSSIBLE_BAR_TYPES order
+    cums = [_get_cum(BAR_TYPE_COLS[bar_type], volume, dollar) for bar_type in POSSIBLE_BAR_TYPES]
+    ths = [_get_threshold(cum, thresholds.get(bar_type, 'auto'), date_time,
+                          rounding=rounding, auto_ratio=auto_ratio)
+           for bar_type, cum in zip(POSSIBLE_BAR_TYPES, cums)]
+    
+    # the compiled kernel releases the GIL, so bar types are sampled in parallel
+    with ThreadPoolExecutor(len(POSSIBLE_BAR_TYPES)) as executor:
+        bars = executor.map(
+            lambda cum, th: _sample_bars(cum, th, date_time, price, volume, dollar),
+            cums, ths)
+        return dict(zip(POSSIBLE_BAR_TYPES, bars))
 
 
-def _get_volume_bar(df, threshold='auto', rounding=-2, auto_ratio=1/50):
-    """Volume bar sampling.
+def sample_bar_streaming(chunks, bar_type, threshold, datetime_col='date_time',
+                         price_col='price', vol_col='volume'):
+    """Bar sampling over tick data read in chunks, e.g. `pd.read_csv(..., chunksize=...)`
+    or parquet row groups, so that the whole dataset never has to fit in memory.
+    Only the running aggregates of the bar left open at the end of a chunk are
+    carried over to the next one, so memory is bounded by the chunk size.
     
     Args:
-        df (dataframe): volume data dataframe
-        threshold (int, optional): threshold for sampling. Defaults to 1000.
-        rounding (int, optional): decimal rounding for threshold. Defaults to -2.
-        auto_ratio (float, optional): ratio for automatic threshold setting. Defaults to 1/50.
+        chunks (iterable): tick data dataframes, in chronological order
+        bar_type (str): the bar type for sampling. Options are 'tick', 'volume' or 'dollar'
+        threshold (int): threshold for sampling. It can not be 'auto', as the daily
+        average requires the whole dataset.
+        datetime_col (str, optional): column name where datetime values. Defaults to 'date_time'.
+        price_col (str, optional): column name where price values. Defaults to 'price'.
+        vol_col (str, optional): column name where volume values. Defaults to 'volume'.
     
     Returns:
-        dataframe: dataframe with volume bars
+        dateframe: dataframe with chosen bar type
     """
-    df['cum_vol'] = df['volume'].cumsum()
+    # check bar type and threshold
+    assert bar_type in POSSIBLE_BAR_TYPES, 'Expected bar_type to be one of {}, but got {} instead'.format(
+        POSSIBLE_BAR_TYPES, bar_type)
+    assert threshold != 'auto', 'Automatic threshold is not available when streaming, please set a threshold'
     
-    # get groups
-    groups = _assign_groups_threshold(
-        df, threshold=threshold, tgt_col='volume', cum_col='cum_vol',
-        rounding=rounding, auto_ratio=auto_ratio)
+    bars = []
+    n_chunks = 0
+    # aggregates of the bar left open and its cumulative value since the last close
+    open_bar = None
+    offset = 0.0
+    for chunk in chunks:
+        n_chunks += 1
+        date_time, price, volume = _get_arrays(chunk, datetime_col, price_col, vol_col)
+        if price.size == 0:
+            continue
+        dollar = np.multiply(price, volume, dtype=np.float64)
+        cum = offset + _get_cum(BAR_TYPE_COLS[bar_type], volume, dollar)
+        
+        # closed bars, plus the open one if the chunk does not end on a close
+        ends = _bar_ends(cum, threshold)
+        starts = np.r_[0, ends + 1]
+        starts = starts[starts < cum.size]
+        values = _monotone_groupby_agg(
+            starts, [date_time, price, price, price, price, price, volume, dollar], BAR_AGG_OPS)
+        
+        # the first bar continues the one left open by the previous chunk, whose
+        # values may have another dtype (e.g. float prices followed by integers)
+        if open_bar is not None:
+            for k, (prev, op) in enumerate(zip(open_bar, BAR_AGG_OPS)):
+                col = values[k].astype(np.result_type(values[k], np.asarray(prev)))
+                col[0] = _merge_agg(prev, col[0], op)
+                values[k] = col
+        
+        if ends.size < starts.size:
+            open_bar = [col[-1] for col in values]
+            values = [col[:-1] for col in values]
+            offset = cum[-1] - (cum[ends[-1]] if ends.size else 0.0)
+        else:
+            open_bar = None
+            offset = 0.0
+        bars.append(pd.DataFrame(dict(zip(BAR_COLUMNS, values)), copy=False))
     
-    # group by groups (of threshold ticks)
-    bars = df.groupby(groups, as_index=False).agg(OrderedDict([
-        ('date_time', 'last'),
-        ('price', ['first', np.max, np.min, 'last']),
-        ('ticks', np.sum),
-        ('volume', np.sum),
-        ('dollar', np.sum),
-    ]))
-    # rename cols
-    bars.columns = bars.columns.droplevel(0)
-    bars.columns = ['date_time', 'open', 'high', 'low', 'close', 
-                    'ticks', 'volume', 'dollar']
-    return bars
+    assert n_chunks, 'No tick data to sample bars from'
+    if not bars:
+        return _aggregate_bars(np.empty(0, dtype=np.int64), date_time, price, volume, None)
+    return pd.concat(bars, ignore_index=True)
 
 
-def _get_dollar_bar(df, threshold='auto', rounding=-2, auto_ratio=1/50):
-    """Dollar bar sampling.
+def _merge_agg(prev, cur, op):
+    """Merge two partial aggregations of the same bar, skipping missing values.
+    
+    Args:
+        prev (scalar): aggregation of the earlier ticks
+        cur (scalar): aggregation of the later ticks
+        op (str): aggregation, as in `_monotone_groupby_agg`
+    
+    Returns:
+        scalar: aggregation of all the ticks
+    """
+    if op == 'first':
+        return cur if pd.isna(prev) else prev
+    if op == 'last':
+        return prev if pd.isna(cur) else cur
+    if op in ('count', 'sum'):
+        return prev + cur
+    return REDUCE_UFUNCS[op](prev, cur)
+
+
+def _get_arrays(df, datetime_col, price_col, vol_col):
+    """Check and extract the datetime, price and volume columns as arrays (no
+    copy of the whole dataframe).
     
     Args:
         df (dataframe): tick data dataframe
-        threshold (int, optional): threshold for sampling. Defaults to 1000.
+        datetime_col (str): column name where datetime values.
+        price_col (str): column name where price values.
+        vol_col (str): column name where volume values.
+    
+    Returns:
+        tuple: datetime, price and volume arrays
+    """
+    # check if cols exist in df
+    assert datetime_col in df.columns, 'Missing {} columns in dataframe'.format(
+        datetime_col)
+    assert price_col in df.columns, 'Missing {} columns in dataframe'.format(
+        price_col)
+    assert vol_col in df.columns, 'Missing {} columns in dataframe'.format(
+        vol_col)
+    
+    # prices and volumes are kept in their own dtype, only dollar values are
+    # computed in float64
+    date_time = df[datetime_col].to_numpy(copy=False)
+    price = df[price_col].to_numpy(copy=False)
+    volume = df[vol_col].to_numpy(copy=False)
+    return date_time, price, volume
+
+
+def _get_bar(date_time, price, volume, tgt_col, threshold='auto', rounding=-2, auto_ratio=1/50):
+    """Bar sampling on the cumulative values of `tgt_col`, shared by tick, volume
+    and dollar bars.
+    
+    Args:
+        date_time (ndarray): datetime values
+        price (ndarray): price values
+        volume (ndarray): volume values
+        tgt_col (str): column to sample on. Options are 'ticks', 'volume' or 'dollar'
+        threshold (int, optional): threshold for sampling. Defaults to 'auto'.
         rounding (int, optional): decimal rounding for threshold. Defaults to -2.
         auto_ratio (float, optional): ratio for automatic threshold setting. Defaults to 1/50.
     
     Returns:
-        dataframe: dataframe with dollar bars
+        dataframe: dataframe with bars
+    """
+    # dollar values are only needed upfront for dollar bars
+    dollar = np.multiply(price, volume, dtype=np.float64) if tgt_col == 'dollar' else None
+    cum = _get_cum(tgt_col, volume, dollar)
+    
+    th = _get_threshold(cum, threshold, date_time, rounding=rounding, auto_ratio=auto_ratio)
+    return _sample_bars(cum, th, date_time, price, volume, dollar)
+
+
+def _get_cum(tgt_col, volume, dollar):
+    """Cumulative values of `tgt_col`, skipping missing values.
+    
+    Args:
+        tgt_col (str): column to sample on. Options are 'ticks', 'volume' or 'dollar'
+        volume (ndarray): volume values
+        dollar (ndarray): dollar values (price times volume), only used for 'dollar'
+    
+    Returns:
+        ndarray: cumulative values, in float64
     """
-    df['cum_dol'] = df['dollar'].cumsum()
+    if tgt_col == 'ticks':
+        return np.arange(1, volume.size + 1, dtype=np.float64)
+    return np.nancumsum(volume if tgt_col == 'volume' else dollar, dtype=np.float64)
+
+
+def _sample_bars(cum, th, date_time, price, volume, dollar=None):
+    """Sample bars closing whenever the cumulative values reach the threshold,
+    with the compiled single pass kernel if numba is available, or with numpy
+    reductions otherwise. Both skip missing values, as pandas groupby.
+    
+    Args:
+        cum (ndarray): cumulative values of the target column, in float64
+        th (float): threshold for bar sampling.
+        date_time (ndarray): datetime values
+        price (ndarray): price values
+        volume (ndarray): volume values
+        dollar (ndarray, optional): dollar values. If None, computed from price and volume
+    
+    Returns:
+        dataframe: dataframe with bars
+    """
+    if not NUMBA_AVAILABLE:
+        return _aggregate_bars(_bar_ends(cum, th), date_time, price, volume, dollar)
+    
+    ends, *values = _make_bars(cum, price, volume, dollar, th)
     
-    # get groups
-    groups = _assign_groups_threshold(
-        df, threshold=threshold, tgt_col='dollar', cum_col='cum_dol',
-        rounding=rounding, auto_ratio=auto_ratio)
+    # datetime of the last tick with a datetime
+    n = ends[-1] + 1 if ends.size else 0
+    starts = ends - values[4] + 1
+    values = _monotone_groupby_agg(starts, [date_time[:n]], ['last']) + values
+    return pd.DataFrame(dict(zip(BAR_COLUMNS, values)), copy=False)
+
+
+def _aggregate_bars(ends, date_time, price, volume, dollar):
+    """Aggregate ticks into bars given their closing ticks, reducing each column
+    separately over the contiguous bar slices.
     
-    # group by groups (of threshold ticks)
-    bars = df.groupby(groups, as_index=False).agg(OrderedDict([
-        ('date_time', 'last'),
-        ('price', ['first', np.max, np.min, 'last']),
-        ('ticks', np.sum),
-        ('volume', np.sum),
-        ('dollar', np.sum),
-    ]))
-    # rename cols
-    bars.columns = bars.columns.droplevel(0)
-    bars.columns = ['date_time', 'open', 'high', 'low', 'close', 
-                    'ticks', 'volume', 'dollar']
+    Args:
+        ends (ndarray): closing tick index of each bar
+        date_time (ndarray): datetime values
+        price (ndarray): price values
+        volume (ndarray): volume values
+        dollar (ndarray): dollar values. If None, computed from price and volume
+    
+    Returns:
+        dataframe: dataframe with bars
+    """
+    # ticks after the last close are an incomplete bar
+    n = ends[-1] + 1 if ends.size else 0
+    price, volume = price[:n], volume[:n]
+    dollar = np.multiply(price, volume, dtype=np.float64) if dollar is None else dollar[:n]
+    starts = np.r_[0, ends[:-1] + 1][:ends.size]
+    
+    values = _monotone_groupby_agg(
+        starts, [date_time[:n], price, price, price, price, price, volume, dollar], BAR_AGG_OPS)
+    bars = pd.DataFrame(dict(zip(BAR_COLUMNS, values)), copy=False)
     return bars
 
 
-def _get_auto_threshold(df, tgt_col, rounding=-2, auto_ratio=1/50):
+def _monotone_groupby_agg(starts, arrays, ops):
+    """Group by aggregation for groups made of contiguous slices, as with sorted
+    labels. No hashing or sorting is needed, each aggregation is either an
+    indexing or a `reduceat` over the group start indices. Missing values are
+    skipped, as in pandas groupby aggregations.
+    
+    Args:
+        starts (ndarray): first index of each group, increasing
+        arrays (list): arrays to aggregate, of same length
+        ops (list): aggregation for each array. Options are 'first', 'last',
+        'max', 'min', 'sum' or 'count'
+    
+    Returns:
+        list: aggregated arrays
+    """
+    size = arrays[0].size if arrays else 0
+    ends = np.r_[starts[1:] - 1, size - 1][:starts.size]
+    
+    out = []
+    for arr, op in zip(arrays, ops):
+        if op == 'first':
+            out.append(arr[_first_valid(arr, starts, ends)])
+        elif op == 'last':
+            out.append(arr[_last_valid(arr, starts, ends)])
+        elif op == 'count':
+            out.append(ends - starts + 1)
+        elif op == 'sum':
+            out.append(_sum_valid(arr, starts))
+        else:
+            out.append(REDUCE_UFUNCS[op].reduceat(arr, starts))
+    return out
+
+
+def _first_valid(arr, starts, ends):
+    """Index of the first non missing value of each group, or of the group end
+    if all of its values are missing.
+    
+    Args:
+        arr (ndarray): values
+        starts (ndarray): first index of each group
+        ends (ndarray): last index of each group
+    
+    Returns:
+        ndarray: index of the first value of each group
+    """
+    null = _isnull(arr)
+    if null is None:
+        return starts
+    pos = np.where(null, arr.size, np.arange(arr.size))
+    return np.minimum(np.minimum.reduceat(pos, starts), ends)
+
+
+def _last_valid(arr, starts, ends):
+    """Index of the last non missing value of each group, or of the group start
+    if all of its values are missing.
+    
+    Args:
+        arr (ndarray): values
+        starts (ndarray): first index of each group
+        ends (ndarray): last index of each group
+    
+    Returns:
+        ndarray: index of the last value of each group
+    """
+    null = _isnull(arr)
+    if null is None:
+        return ends
+    pos = np.where(null, -1, np.arange(arr.size))
+    return np.maximum(np.maximum.reduceat(pos, starts), starts)
+
+
+def _sum_valid(arr, starts):
+    """Sum of each group, missing values counted as zero.
+    
+    Args:
+        arr (ndarray): values
+        starts (ndarray): first index of each group
+    
+    Returns:
+        ndarray: sum of each group
+    """
+    null = _isnull(arr)
+    if null is not None:
+        arr = np.where(null, 0, arr)
+    return np.add.reduceat(arr, starts)
+
+
+def _isnull(arr):
+    """Missing values mask of an array.
+    
+    Args:
+        arr (ndarray): values
+    
+    Returns:
+        ndarray: boolean mask, or None if there are no missing values
+    """
+    if arr.dtype.kind in 'biu':
+        return None
+    null = pd.isna(arr)
+    return null if null.any() else None
+
+
+def _get_auto_threshold(date_time, cum, rounding=-2, auto_ratio=1/50):
     """Calculate automatic threshold, defined as the daily average of chosen tick
-    bar, defined in `tgt_col`, adjusted by a ratio, defined in `auto_ratio`.
+    bar, given by its cumulative values `cum`, adjusted by a ratio, defined in `auto_ratio`.
     
     Args:
-        df (dataframe): tick data dataframe
-        tgt_col (str): column name for average daily calculation
+        date_time (ndarray): datetime values
+        cum (ndarray): cumulative values of the chosen tick bar, skipping missing values
         rounding (int, optional): decimal rounding for threshold. Defaults to -2.
         auto_ratio (float optional): ratio for automatic threshold setting. Defaults to 1/50.
     
     Returns:
         int: calculated threshold
     """
+    # as in a resample, ticks without datetime are left out
+    null = _isnull(date_time)
+    if null is not None:
+        cum = np.cumsum(np.where(null, 0, np.diff(cum, prepend=0)))
+        date_time = date_time[~null]
+    if date_time.size == 0:
+        return np.nan
+    
+    # mean over business days (as in a 'B' resample, weekend ticks count towards
+    # the previous business day and days without ticks count as zero)
+    first, last = pd.Timestamp(date_time.min()), pd.Timestamp(date_time.max())
+    mean_no_ticks = cum[-1] / _count_business_days(first.date(), last.date())
+    
     # ~1/50 of mean daily number of ticks
-    mean_no_ticks = df.set_index('date_time').resample('B').sum()[tgt_col].mean()
     th = np.round(mean_no_ticks * auto_ratio, rounding) # round to the nearest hundred
     return th
 
 
-def _assign_groups_threshold(df, threshold, tgt_col, cum_col, rounding=-2, auto_ratio=1/50):
-    """Helper function for bar labeling. It helps to efficiently group bars by label
-    and then get the open high low close values.
+def _count_business_days(first, last):
+    """Number of business days spanned by a period, counting weekend days
+    towards the previous business day.
     
     Args:
-        df (dataframe): tick data dataframe
-        threshold (int): threshold for bar samplint.
-        tgt_col (str): column name with values of interest.
-        cum_col (str): column name with cumulative values of `tgt_col`.
+        first (date): first day of the period
+        last (date): last day of the period
+    
+    Returns:
+        int: number of business days
+    """
+    days = np.busday_offset([first, last], 0, roll='backward')
+    return int(np.busday_count(days[0], days[1])) + 1
+
+
+def _get_threshold(cum, threshold, date_time, rounding=-2, auto_ratio=1/50):
+    """Resolve the sampling threshold, calculating it if set to 'auto'.
+    
+    Args:
+        cum (ndarray): cumulative values of interest, skipping missing values.
+        threshold (int): threshold for bar sampling, or 'auto'.
+        date_time (ndarray): datetime values.
         rounding (int, optional): decimal rounding for threshold. Defaults to -2.
         auto_ratio (float, optional): ratio for automatic threshold setting. Defaults to 1/50.
     
     Returns:
-        array-like: array with groups labels
+        float: threshold
     """
-    # make a copy
-    tmp = df.copy(deep=True)
-    
     # get auto threshold if needed
     if threshold == 'auto':
-        th = _get_auto_threshold(df, tgt_col=tgt_col, rounding=rounding, auto_ratio=auto_ratio)
-        print('Auto threshold set to {:,}'.format(th))
+        th = _get_auto_threshold(date_time, cum, rounding=rounding, auto_ratio=auto_ratio)
+        logger.debug('Auto threshold set to %s', th)
     else:
         th = threshold   
+    return th
+
+
+@njit(cache=True)
+def _bar_ends(cum, th):
+    """Index of the closing tick of each bar. A bar is closed by the first tick
+    whose cumulative value, counted from the close of the previous bar, reaches
+    `th`. When `cum` is non-decreasing, each close is found by a binary search,
+    so the loop runs once per bar rather than once per tick. Negative values
+    (e.g. negative prices) break that order, and the closes are then found by a
+    sequential scan.
+    
+    Args:
+        cum (ndarray): cumulative values of the target column.
+        th (float): threshold for bar sampling.
+    
+    Returns:
+        ndarray: closing tick index of each complete bar
+    """
+    sorted_ = True
+    for i in range(1, cum.size):
+        if cum[i] < cum[i-1]:
+            sorted_ = False
+            break
+    
+    ends = np.empty(cum.size, dtype=np.int64)
+    n_bars = 0
+    ref = 0.0
+    start = 0
+    while start < cum.size:
+        # first tick with cum - ref >= th (at least one tick per bar)
+        if sorted_:
+            end = max(np.searchsorted(cum, ref + th), start)
+        else:
+            end = start
+            while end < cum.size and cum[end] - ref < th:
+                end += 1
+        if end == cum.size:
+            break
+        ends[n_bars] = end
+        n_bars += 1
+        ref = cum[end]
+        start = end + 1
+    return ends[:n_bars]
+
+
+@njit(cache=True, nogil=True)
+def _make_bars(cum, price, volume, dollar, th):
+    """Fused bar sampling kernel. Bar closes are found by `_bar_ends`, then a
+    single pass over the ticks accumulates the open, high, low, close, volume
+    and dollar values of each bar, skipping missing values as pandas groupby.
+    
+    Args:
+        cum (ndarray): cumulative values of the target column.
+        price (ndarray): price values
+        volume (ndarray): volume values
+        dollar (ndarray): dollar values. If None, computed on the fly in float64
+        th (float): threshold for bar sampling.
+    
+    Returns:
+        tuple: closing tick index, open, high, low, close, ticks, volume and
+        dollar arrays, one value per bar
+    """
+    ends = _bar_ends(cum, th)
+    n_bars = ends.size
+    open_ = np.empty(n_bars, dtype=price.dtype)
+    high = np.empty(n_bars, dtype=price.dtype)
+    low = np.empty(n_bars, dtype=price.dtype)
+    close = np.empty(n_bars, dtype=price.dtype)
+    ticks = np.empty(n_bars, dtype=np.int64)
+    vol = np.zeros(n_bars, dtype=volume.dtype)
+    dol = np.zeros(n_bars, dtype=np.float64)
     
-    # define empty group column
-    tmp['group'] = np.nan
-    
-    # define comparison ref
-    ref = 0
-    group = 0
-    ref_row = 0
-    for row in range(df.shape[0]):
-        if tmp.iloc[row][cum_col] >= th:
-            ref = tmp.iloc[row][cum_col] # new ref
-            # reset counting
-            tmp[cum_col] -= ref
-            tmp.iloc[ref_row:(row+1), -1] = group
-            group += 1
-            ref_row = row + 1
-    return tmp['group'].values
+    start = 0
+    for k in range(n_bars):
+        end = ends[k]
+        o = hi = lo = c = price[start]
+        for i in range(start, end + 1):
+            p = price[i]
+            # NaN comparisons are false, so missing values are skipped
+            if p == p:
+                if o != o:
+                    o = p
+                if not p <= hi:
+                    hi = p
+                if not p >= lo:
+                    lo = p
+                c = p
+            x = volume[i]
+            if x == x:
+                vol[k] += x
+            if dollar is None:
+                d = np.float64(p) * np.float64(x)
+            else:
+                d = dollar[i]
+            if d == d:
+                dol[k] += d
+        open_[k] = o
+        high[k] = hi
+        low[k] = lo
+        close[k] = c
+        ticks[k] = end - start + 1
+        start = end + 1
+    return ends, open_, high, low, close, ticks, vol, dol